@@ -1,9 +1,25 @@
+import asyncio
+import contextlib
+import dbm
+import json
 import requests
 import os
-import time
+import posixpath
 import re
-import gzip
+import shelve
 import shutil
+import string
+try:
+    # ISA-L's igzip is a drop-in replacement for gzip with much faster decompression
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
 
 # --- Configuration ---
 # List of hospital systems/domains to check in the Seattle area.
@@ -23,6 +39,9 @@ HOSPITAL_SYSTEMS = {
 # Directory to save downloaded files
 OUTPUT_DIR = "hospital_mrf_seattle"
 
+# Cache of raw cms-hpt.txt bodies, reused (and re-parsed) while the server reports the file unchanged
+CACHE_PATH = os.path.join(OUTPUT_DIR, ".cms_hpt_cache.db")
+
 # User agent to mimic a browser
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
@@ -31,70 +50,227 @@ HEADERS = {
 # Delay between requests to a domain to be respectful
 REQUEST_DELAY = 2  # seconds
 
+# Maximum number of MRF downloads running at once (across all hosts)
+MAX_DOWNLOAD_WORKERS = 4
+
+# Hosts whose keep-alive connections stay pooled for the whole run. Covers every
+# hospital domain plus the CDN hosts their MRFs live on, so none are evicted mid-run.
+MAX_POOLED_HOSTS = 32
+
+# Buffer size used when streaming downloads and decompressing MRFs
+_COPY_BUF = 1 << 20  # 1MB
+
+# Matches mrf-url lines, case insensitive, handling potential extra spaces
+# Example line: mrf-url: https://example.com/123456789_hospital_standardcharges.json
+_MRF_URL_RE = re.compile(r"^\s*mrf-url\s*:\s*(https?://\S+)", re.IGNORECASE | re.MULTILINE)
+# Fallback for loosely formatted files (one URL per match):
+#   group 1: the URL following an mrf-url: anywhere in a line, even after other key: value text
+#   group 2: a URL at the start of a line whose own text (not the rest of the line) contains
+#            .json/.csv and standardcharges, price-transparency or mrf; trailing text is ignored
+_FALLBACK_RE = re.compile(
+    r"mrf-url:\s*(https?://\S+)"
+    r"|^\s*(?=https?://\S*(?:\.json|\.csv))(https?://\S*(?:standardcharges|price-transparency|mrf)\S*)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# MRF format by URL path suffix (checked against the lowercased path, so query strings are ignored)
+_FMT = {'.csv': 'csv', '.csv.gz': 'csv', '.json': 'json', '.json.gz': 'json', '.xml': 'xml', '.xml.gz': 'xml'}
+
+# Translation table for filenames derived from URLs: anything but ASCII letters, digits and '._-'
+# becomes '_'. The defaultdict covers every code point, not just the ones listed.
+_SAFE_CHARS = frozenset(string.ascii_letters + string.digits + '._-')
+_SAFE_TABLE = defaultdict(lambda: '_', {ord(c): c for c in _SAFE_CHARS})
+
+# Shared session so the cms-hpt.txt fetch and MRF downloads reuse keep-alive connections
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+_ADAPTER = HTTPAdapter(
+    pool_connections=MAX_POOLED_HOSTS,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False),
+)
+SESSION.mount("https://", _ADAPTER)
+SESSION.mount("http://", _ADAPTER)
+
 # --- Helper Functions ---
 
+def log(message):
+    """Prints a status line above any active download progress bars instead of through them."""
+    tqdm.write(message)
+
+def open_cache(path):
+    """
+    Opens the cms-hpt.txt cache shelf as a context manager. If the file can't be
+    opened (corrupt, or written by a different dbm backend), an empty in-memory
+    dict is used for this run instead.
+    """
+    try:
+        return shelve.open(path)
+    except dbm.error as e:
+        log(f"Could not open cache {path} ({e}). Continuing without it.")
+        return contextlib.nullcontext({})
+
 def ensure_dir(directory):
     """Creates the directory if it doesn't exist."""
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-        print(f"Created directory: {directory}")
+    os.makedirs(directory, exist_ok=True)
+
+def url_path(url):
+    """Returns the path of a URL without its query string, fragment or ;params."""
+    return urlparse(url).path
+
+def load_validators(path):
+    """Loads the Last-Modified/ETag headers saved alongside a downloaded file, if any."""
+    try:
+        with open(f"{path}.meta") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def get_validators(headers):
+    """Extracts the Last-Modified/ETag headers from an HTTP response's headers."""
+    return {name: headers[name] for name in ('Last-Modified', 'ETag') if name in headers}
+
+def save_validators(path, headers):
+    """
+    Saves the response's Last-Modified/ETag headers to `path`.meta for later revalidation.
+    A stale .meta is removed if the response has neither header.
+    """
+    validators = get_validators(headers)
+    if validators:
+        with open(f"{path}.meta", "w") as f:
+            json.dump(validators, f)
+    elif os.path.exists(f"{path}.meta"):
+        os.remove(f"{path}.meta")
+
+def validators_match(saved, current):
+    """True if every validator present in both saved and current has the same value."""
+    shared = [name for name in ('ETag', 'Last-Modified') if name in saved and name in current]
+    return bool(shared) and all(saved[name] == current[name] for name in shared)
+
+def conditional_headers(validators):
+    """Builds If-Modified-Since/If-None-Match request headers from saved validators."""
+    headers = {}
+    if 'Last-Modified' in validators:
+        headers['If-Modified-Since'] = validators['Last-Modified']
+    if 'ETag' in validators:
+        headers['If-None-Match'] = validators['ETag']
+    return headers
+
+def stream_decompress(response, decompressed_path, total_size):
+    """
+    Decompresses a gzipped HTTP response straight into decompressed_path as it downloads,
+    so the .gz file never touches the disk. Output goes to a .part file that only replaces
+    decompressed_path once complete, and is removed on failure.
+    """
+    log(f"  Gzipped file detected. Decompressing while downloading to: {decompressed_path}")
+    part_path = f"{decompressed_path}.part"
+    try:
+        with gzip.open(response.raw, 'rb') as f_in, open(part_path, 'wb') as f_out, \
+             tqdm(total=total_size or None, unit='B', unit_scale=True, unit_divisor=1024, desc=os.path.basename(decompressed_path)) as bar:
+            while True:
+                chunk = f_in.read(_COPY_BUF)
+                if not chunk:
+                    break
+                f_out.write(chunk)
+                bar.update(response.raw.tell() - bar.n) # Progress in compressed bytes read off the wire
+        os.replace(part_path, decompressed_path)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    log(f"  Successfully downloaded and decompressed to: {decompressed_path}")
 
 def download_file(url, output_path):
-    """Downloads a file from a URL to the specified output path."""
-    print(f"Attempting to download: {url}")
+    """
+    Downloads a file from a URL to the specified output path.
+    If validators were saved by a previous download, the server is asked first
+    whether the file changed. The download is skipped on 304 Not Modified, or on a
+    200 whose ETag/Last-Modified match the saved ones (servers that ignore
+    conditional headers on HEAD).
+    """
+    log(f"Attempting to download: {url}")
+    final_path = output_path[:-3] if output_path.endswith(".gz") else output_path
     try:
-        response = requests.get(url, headers=HEADERS, stream=True, timeout=120) # Increased timeout for potentially very large files
+        validators = load_validators(final_path) if os.path.exists(final_path) else {}
+        if validators:
+            head_response = SESSION.head(url, headers=conditional_headers(validators), timeout=30, allow_redirects=True)
+            if head_response.status_code == 304 or \
+               (head_response.status_code == 200 and validators_match(validators, get_validators(head_response.headers))):
+                log(f"  {final_path} is unchanged on the server. Skipping.")
+                return True
+        
+        response = SESSION.get(url, stream=True, timeout=120) # Increased timeout for potentially very large files
         response.raise_for_status()  # Raise an exception for HTTP errors
         
         total_size = int(response.headers.get('content-length', 0))
-        block_size = 8192 # 8KB
+        block_size = _COPY_BUF
         
-        with open(output_path, "wb") as f:
-            downloaded_size = 0
-            for chunk in response.iter_content(chunk_size=block_size):
-                if chunk:
-                    f.write(chunk)
-                    downloaded_size += len(chunk)
-                    if total_size > 0:
-                        progress = (downloaded_size / total_size) * 100
-                        print(f"  Downloading... {downloaded_size / (1024*1024):.2f}MB / {total_size / (1024*1024):.2f}MB ({progress:.2f}%) \r", end="")
-        print(f"\n  Successfully downloaded to: {output_path}")
+        # A .gz served with Content-Encoding: gzip is decoded by requests itself,
+        # so only stream-decompress when the body is the raw gzip file.
+        content_encoding = response.headers.get('content-encoding', '').lower()
+        if output_path.endswith(".gz") and 'gzip' not in content_encoding:
+            stream_decompress(response, final_path, total_size)
+            save_validators(final_path, response.headers)
+            return True
+        
+        # Download to a .part file so an interrupted download never replaces a good copy
+        part_path = f"{output_path}.part"
+        try:
+            with open(part_path, "wb") as f, \
+                 tqdm(total=total_size or None, unit='B', unit_scale=True, unit_divisor=1024, desc=os.path.basename(output_path)) as bar:
+                for chunk in response.iter_content(chunk_size=block_size):
+                    if chunk:
+                        f.write(chunk)
+                        bar.update(len(chunk))
+            os.replace(part_path, output_path)
+        except Exception:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        log(f"  Successfully downloaded to: {output_path}")
         
         if output_path.endswith(".gz"):
             decompressed_path = output_path[:-3]
-            print(f"  Gzipped file detected. Decompressing to: {decompressed_path}")
+            decompressed_part_path = f"{decompressed_path}.part"
+            log(f"  Gzipped file detected. Decompressing to: {decompressed_path}")
             try:
-                with gzip.open(output_path, 'rb') as f_in:
-                    with open(decompressed_path, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                print(f"  Successfully decompressed to: {decompressed_path}")
+                with open(output_path, 'rb') as raw_in:
+                    if hasattr(os, 'posix_fadvise'): # Let the kernel read ahead aggressively (POSIX only)
+                        os.posix_fadvise(raw_in.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    with gzip.open(raw_in, 'rb') as f_in:
+                        with open(decompressed_part_path, 'wb') as f_out:
+                            shutil.copyfileobj(f_in, f_out, length=_COPY_BUF)
+                os.replace(decompressed_part_path, decompressed_path)
+                log(f"  Successfully decompressed to: {decompressed_path}")
                 os.remove(output_path)
-                print(f"  Removed original .gz file: {output_path}")
+                log(f"  Removed original .gz file: {output_path}")
+                save_validators(final_path, response.headers)
             except Exception as e:
-                print(f"  Error decompressing {output_path}: {e}")
-                print(f"  The gzipped file remains at: {output_path}")
+                if os.path.exists(decompressed_part_path):
+                    os.remove(decompressed_part_path)
+                log(f"  Error decompressing {output_path}: {e}")
+                log(f"  The gzipped file remains at: {output_path}")
+        else:
+            save_validators(final_path, response.headers)
         
         return True
     except requests.exceptions.Timeout:
-        print(f"  Timeout downloading {url}. The file might be too large or the server too slow.")
+        log(f"  Timeout downloading {url}. The file might be too large or the server too slow.")
         return False
     except requests.exceptions.RequestException as e:
-        print(f"  Error downloading {url}: {e}")
+        log(f"  Error downloading {url}: {e}")
         return False
     except Exception as e:
-        print(f"  An unexpected error occurred while downloading {url}: {e}")
+        log(f"  An unexpected error occurred while downloading {url}: {e}")
         return False
 
 def parse_cms_hpt_txt(content):
     """
     Parses the content of a cms-hpt.txt file to extract MRF URLs and their likely format.
-    Returns a list of dictionaries: [{'url': str, 'format': str ('csv', 'json', 'unknown')}]
+    Returns a list of dictionaries: [{'url': str, 'format': str ('csv', 'json', 'xml', 'unknown')}]
     """
     parsed_entries = []
-    # Regex to find mrf-url lines, case insensitive, handling potential extra spaces
-    # Example line: mrf-url: https://example.com/123456789_hospital_standardcharges.json
-    regex = re.compile(r"^\s*mrf-url\s*:\s*(https?://\S+)", re.IGNORECASE | re.MULTILINE)
-    matches = regex.findall(content)
+    matches = _MRF_URL_RE.findall(content)
     
     raw_urls = []
     for url in matches:
@@ -102,126 +278,157 @@ def parse_cms_hpt_txt(content):
     
     # Fallback for simpler parsing if regex finds nothing or to catch additional direct links
     if not matches:
-        lines = content.splitlines()
-        for line in lines:
-            stripped_line = line.strip()
-            line_lower = stripped_line.lower()
-            # Check for lines that look like mrf-url definitions
-            if "mrf-url:" in line_lower:
-                try:
-                    url_part = stripped_line.split(":", 1)[1].strip()
-                    if url_part.startswith("http"):
-                        raw_urls.append(url_part)
-                except IndexError:
-                    continue # Malformed line
-            # Check for lines that are just URLs (less common for cms-hpt.txt main MRF links but possible)
-            elif stripped_line.startswith("http") and \
-                 (".json" in line_lower or ".csv" in line_lower) and \
-                 ("standardcharges" in line_lower or "price-transparency" in line_lower or "mrf" in line_lower):
-                 raw_urls.append(stripped_line)
+        raw_urls.extend(m.group(1) or m.group(2) for m in _FALLBACK_RE.finditer(content))
 
     unique_urls = sorted(list(set(raw_urls))) # Process unique URLs, sorted for consistency
 
     for url_str in unique_urls:
-        url_lower = url_str.lower()
-        file_format = 'unknown'
-        # Prioritize .csv.gz or .csv
-        if '.csv.gz' in url_lower or url_lower.endswith('.csv'):
-            file_format = 'csv'
-        elif '.json.gz' in url_lower or url_lower.endswith('.json'):
-            file_format = 'json'
-        # Add more specific checks if needed, e.g., for .xml
-        
+        path = url_path(url_str).lower()
+        file_format = next((fmt for suffix, fmt in _FMT.items() if path.endswith(suffix)), 'unknown')
         parsed_entries.append({'url': url_str, 'format': file_format})
         
     return parsed_entries
 
 # --- Main Script ---
-def main():
-    print("Starting Seattle Hospital MRF Downloader (CSV Prioritized)...")
-    ensure_dir(OUTPUT_DIR)
+async def download_serially(jobs, host_lock, executor):
+    """
+    Downloads a list of (url, output_path) jobs that share a host one at a time,
+    pausing REQUEST_DELAY before each. The downloads themselves run on `executor`.
+    """
+    loop = asyncio.get_running_loop()
+    for mrf_url, output_file_path in jobs:
+        async with host_lock:
+            await asyncio.sleep(REQUEST_DELAY)
+            await loop.run_in_executor(executor, download_file, mrf_url, output_file_path)
 
-    for hospital_name, base_url in HOSPITAL_SYSTEMS.items():
-        print(f"\n--- Processing: {hospital_name} ({base_url}) ---")
-        
-        clean_base_url = base_url.rstrip('/')
-        cms_hpt_txt_url = f"{clean_base_url}/cms-hpt.txt"
-        
-        print(f"Attempting to fetch cms-hpt.txt from: {cms_hpt_txt_url}")
+async def process_hospital(hospital_name, base_url, domain_locks, executor, body_cache, existing_files):
+    """
+    Fetches a hospital's cms-hpt.txt and downloads the MRFs it lists.
+    Requests to the same domain are serialized through `domain_locks` so that
+    REQUEST_DELAY is honoured per domain while different domains proceed concurrently.
+    `body_cache` maps a cms-hpt.txt URL to its (validators, body) from a previous run;
+    if the server answers 304 the cached body is parsed instead of downloading it again.
+    `existing_files` holds the names of files already in OUTPUT_DIR.
+    """
+    log(f"\n--- Processing: {hospital_name} ({base_url}) ---")
+    
+    clean_base_url = base_url.rstrip('/')
+    cms_hpt_txt_url = f"{clean_base_url}/cms-hpt.txt"
+    
+    log(f"[{hospital_name}] Attempting to fetch cms-hpt.txt from: {cms_hpt_txt_url}")
+    
+    cached = body_cache.get(cms_hpt_txt_url)
+    request_headers = conditional_headers(cached[0]) if cached else None
+    
+    try:
+        async with domain_locks[urlsplit(cms_hpt_txt_url).netloc]:
+            await asyncio.sleep(REQUEST_DELAY)
+            response = await asyncio.to_thread(SESSION.get, cms_hpt_txt_url, headers=request_headers, timeout=30)
         
-        try:
-            time.sleep(REQUEST_DELAY)
-            response = requests.get(cms_hpt_txt_url, headers=HEADERS, timeout=30)
+        if response.status_code in (200, 304):
+            if response.status_code == 304:
+                log(f"[{hospital_name}] cms-hpt.txt unchanged since last run. Parsing cached copy for MRF URLs...")
+                content = cached[1]
+            else:
+                log(f"[{hospital_name}] cms-hpt.txt found. Parsing for MRF URLs...")
+                # Decode explicitly: response.text falls back to slow charset detection when no charset is sent
+                content = response.content.decode('utf-8-sig', 'replace')
+                body_cache[cms_hpt_txt_url] = (get_validators(response.headers), content)
+            # Always re-parse (it's cheap) so parser changes apply to cached files too
+            mrf_entries = parse_cms_hpt_txt(content)
             
-            if response.status_code == 200:
-                print("  cms-hpt.txt found. Parsing for MRF URLs...")
-                mrf_entries = parse_cms_hpt_txt(response.text)
-                
-                csv_links = [entry for entry in mrf_entries if entry['format'] == 'csv']
-                json_links = [entry for entry in mrf_entries if entry['format'] == 'json']
-                unknown_links = [entry for entry in mrf_entries if entry['format'] == 'unknown' and entry not in csv_links and entry not in json_links]
-                
-                # Order: CSVs first, then JSONs, then Unknowns
-                ordered_mrf_links = csv_links + json_links + unknown_links
-                
-                if ordered_mrf_links:
-                    print(f"  Found {len(ordered_mrf_links)} potential MRF URL(s) (prioritizing CSV):")
-                    for i, mrf_entry in enumerate(ordered_mrf_links):
-                        mrf_url = mrf_entry['url']
-                        mrf_format = mrf_entry['format']
-                        print(f"    {i+1}. {mrf_url} (Detected format: {mrf_format})")
-                        
-                        try:
-                            file_name_from_url = mrf_url.split("/")[-1]
-                            # Remove query parameters from filename if any
-                            file_name_from_url = file_name_from_url.split("?")[0]
-                            file_name_safe = "".join(c if c.isalnum() or c in ('.', '_', '-') else '_' for c in file_name_from_url)
-                            
-                            if not file_name_safe or file_name_safe == "_": # if the url ends with / or only had non-alphanum characters
-                                extension = mrf_format if mrf_format != 'unknown' else 'dat' # Use 'dat' for truly unknown
-                                file_name_safe = f"{hospital_name.replace(' ','_')}_mrf_{i+1}.{extension}"
-                        except Exception:
-                             extension = mrf_format if mrf_format != 'unknown' else 'dat'
-                             file_name_safe = f"{hospital_name.replace(' ','_')}_mrf_{i+1}.{extension}"
-
-                        # Ensure the filename has an extension if the original URL part didn't
-                        if '.' not in file_name_safe and mrf_format != 'unknown':
-                            file_name_safe = f"{file_name_safe}.{mrf_format}"
-                        elif '.' not in file_name_safe and mrf_format == 'unknown':
-                             file_name_safe = f"{file_name_safe}.dat"
-
-
-                        output_file_path = os.path.join(OUTPUT_DIR, f"{hospital_name.replace(' ','_')}_{file_name_safe}")
+            # parse_cms_hpt_txt already dedups URLs, so a single pass into buckets is enough
+            csv_links, json_links, xml_links, unknown_links = [], [], [], []
+            bucket = {'csv': csv_links, 'json': json_links, 'xml': xml_links, 'unknown': unknown_links}
+            for entry in mrf_entries:
+                bucket[entry['format']].append(entry)
+            
+            # Order: CSVs first, then JSONs, then XMLs, then Unknowns
+            ordered_mrf_links = csv_links + json_links + xml_links + unknown_links
+            
+            if ordered_mrf_links:
+                log(f"[{hospital_name}] Found {len(ordered_mrf_links)} potential MRF URL(s) (prioritizing CSV):")
+                downloads_by_host = defaultdict(list)
+                for i, mrf_entry in enumerate(ordered_mrf_links):
+                    mrf_url = mrf_entry['url']
+                    mrf_format = mrf_entry['format']
+                    log(f"[{hospital_name}]   {i+1}. {mrf_url} (Detected format: {mrf_format})")
+                    
+                    try:
+                        # Last path segment only, so query strings, fragments and ;params are dropped
+                        file_name_from_url = posixpath.basename(url_path(mrf_url))
+                        file_name_safe = file_name_from_url.translate(_SAFE_TABLE)
                         
-                        decompressed_output_path = output_file_path[:-3] if output_file_path.endswith(".gz") else output_file_path
-                        final_file_exists = os.path.exists(decompressed_output_path)
-                        if output_file_path.endswith(".gz") and os.path.exists(output_file_path): # Original .gz still exists
-                            final_file_exists = True
+                        if not file_name_safe or file_name_safe == "_": # if the url ends with / or only had non-alphanum characters
+                            extension = mrf_format if mrf_format != 'unknown' else 'dat' # Use 'dat' for truly unknown
+                            file_name_safe = f"{hospital_name.replace(' ','_')}_mrf_{i+1}.{extension}"
+                    except Exception:
+                         extension = mrf_format if mrf_format != 'unknown' else 'dat'
+                         file_name_safe = f"{hospital_name.replace(' ','_')}_mrf_{i+1}.{extension}"
 
+                    # Ensure the filename has an extension if the original URL part didn't
+                    if '.' not in file_name_safe and mrf_format != 'unknown':
+                        file_name_safe = f"{file_name_safe}.{mrf_format}"
+                    elif '.' not in file_name_safe and mrf_format == 'unknown':
+                         file_name_safe = f"{file_name_safe}.dat"
 
-                        if final_file_exists:
-                            print(f"  File {decompressed_output_path} (or its gzipped original) already exists. Skipping.")
-                            continue
-                        
-                        time.sleep(REQUEST_DELAY)
-                        download_file(mrf_url, output_file_path)
-                else:
-                    print(f"  No MRF URLs found in {cms_hpt_txt_url}. You might need to check their website manually for a 'Price Transparency' page.")
-            
-            elif response.status_code == 404:
-                print(f"  cms-hpt.txt not found at {cms_hpt_txt_url} (404 Error).")
-                print(f"  Consider manually checking the '{hospital_name}' website for 'Price Transparency' or 'Standard Charges'.")
+
+                    output_file_path = os.path.join(OUTPUT_DIR, f"{hospital_name.replace(' ','_')}_{file_name_safe}")
+                    
+                    decompressed_output_path = output_file_path[:-3] if output_file_path.endswith(".gz") else output_file_path
+                    decompressed_name = os.path.basename(decompressed_output_path)
+                    # The original .gz still existing also counts
+                    final_file_exists = decompressed_name in existing_files or os.path.basename(output_file_path) in existing_files
+
+                    # Files with saved validators are revalidated by download_file instead of skipped
+                    if final_file_exists and f"{decompressed_name}.meta" not in existing_files:
+                        log(f"[{hospital_name}] File {decompressed_output_path} (or its gzipped original) already exists. Skipping.")
+                        continue
+                    
+                    # Claim the name so another URL with the same file name is not downloaded over it this run
+                    existing_files.add(decompressed_name)
+                    existing_files.discard(f"{decompressed_name}.meta")
+                    downloads_by_host[urlsplit(mrf_url).netloc].append((mrf_url, output_file_path))
+                
+                # Different hosts download in parallel; same-host files stay serial and keep the delay
+                await asyncio.gather(*[
+                    download_serially(jobs, domain_locks[host], executor)
+                    for host, jobs in downloads_by_host.items()
+                ])
             else:
-                print(f"  Failed to fetch cms-hpt.txt. Status code: {response.status_code}")
-
-        except requests.exceptions.Timeout:
-            print(f"  Timeout while trying to access {cms_hpt_txt_url}.")
-        except requests.exceptions.ConnectionError:
-            print(f"  Connection error while trying to access {cms_hpt_txt_url}. Check the domain or your internet connection.")
-        except requests.exceptions.RequestException as e:
-            print(f"  Error fetching cms-hpt.txt for {hospital_name}: {e}")
-        except Exception as e:
-            print(f"  An unexpected error occurred while processing {hospital_name}: {e}")
+                log(f"[{hospital_name}] No MRF URLs found in {cms_hpt_txt_url}. You might need to check their website manually for a 'Price Transparency' page.")
+        
+        elif response.status_code == 404:
+            log(f"[{hospital_name}] cms-hpt.txt not found at {cms_hpt_txt_url} (404 Error).")
+            log(f"[{hospital_name}] Consider manually checking their website for 'Price Transparency' or 'Standard Charges'.")
+        else:
+            log(f"[{hospital_name}] Failed to fetch cms-hpt.txt. Status code: {response.status_code}")
+
+    except requests.exceptions.Timeout:
+        log(f"[{hospital_name}] Timeout while trying to access {cms_hpt_txt_url}.")
+    except requests.exceptions.ConnectionError:
+        log(f"[{hospital_name}] Connection error while trying to access {cms_hpt_txt_url}. Check the domain or your internet connection.")
+    except requests.exceptions.RequestException as e:
+        log(f"[{hospital_name}] Error fetching cms-hpt.txt: {e}")
+    except Exception as e:
+        log(f"[{hospital_name}] An unexpected error occurred while processing this hospital: {e}")
+
+async def process_all_hospitals():
+    """Processes every hospital system concurrently, one coroutine per hospital."""
+    domain_locks = defaultdict(asyncio.Semaphore) # One in-flight request per domain
+    existing_files = {entry.name for entry in os.scandir(OUTPUT_DIR)} # One directory scan instead of a stat per MRF
+    # The shelf is only touched from coroutines, never from executor threads
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor, open_cache(CACHE_PATH) as body_cache:
+        await asyncio.gather(*[
+            process_hospital(hospital_name, base_url, domain_locks, executor, body_cache, existing_files)
+            for hospital_name, base_url in HOSPITAL_SYSTEMS.items()
+        ])
+
+def main():
+    print("Starting Seattle Hospital MRF Downloader (CSV Prioritized)...")
+    ensure_dir(OUTPUT_DIR)
+
+    asyncio.run(process_all_hospitals())
 
     print("\n--- Script Finished ---")
     print(f"Downloaded files (if any) are in the '{OUTPUT_DIR}' directory.")